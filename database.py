@@ -1,31 +1,188 @@
 import os
+import atexit
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from collections import deque
 from contextlib import contextmanager
 
+# Per-connection settings; journal_mode=WAL is persistent and set once in init_database
+CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-64000',
+    'PRAGMA mmap_size=268435456',
+)
+
+# Bump when the schema in init_database changes; stored in PRAGMA user_version
+SCHEMA_VERSION = 3
+
+# Copies rows out of pre-v3 tables, converting text timestamps to epoch seconds
+EPOCH_MIGRATIONS = {
+    'users': '''
+        INSERT INTO users (user_id, username, first_name, joined_date, last_active)
+        SELECT user_id, username, first_name,
+               strftime('%s', joined_date), strftime('%s', last_active)
+        FROM users_old
+    ''',
+    'query_logs': '''
+        INSERT INTO query_logs (id, user_id, query, timestamp)
+        SELECT id, user_id, query, strftime('%s', timestamp)
+        FROM query_logs_old
+    ''',
+    'chats': '''
+        INSERT INTO chats (chat_id, chat_type, chat_title, joined_date, last_active, is_active)
+        SELECT chat_id, chat_type, chat_title,
+               strftime('%s', joined_date), strftime('%s', last_active), is_active
+        FROM chats_old
+    ''',
+}
+
+# Buffered query logs are written once this many rows are pending
+LOG_FLUSH_SIZE = 500
+
+# RETURNING lets an upsert hand back the stored row without a second SELECT
+SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Hot-path statements, kept as constants so the connection's statement cache hits
+SQL_ADD_USER = '''
+    INSERT INTO users (user_id, username, first_name, last_active)
+    VALUES (?, ?, ?, strftime('%s', 'now'))
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_active = strftime('%s', 'now')
+'''
+
+# Buffered touches carry the time of the message, not of the flush
+SQL_TOUCH_USER = '''
+    INSERT INTO users (user_id, username, last_active)
+    VALUES (?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = excluded.username,
+        last_active = excluded.last_active
+'''
+
+SQL_TRACK_CHAT = '''
+    INSERT INTO chats (chat_id, chat_type, chat_title, last_active)
+    VALUES (?, ?, ?, strftime('%s', 'now'))
+    ON CONFLICT(chat_id) DO UPDATE SET
+        chat_type = excluded.chat_type,
+        chat_title = excluded.chat_title,
+        last_active = strftime('%s', 'now'),
+        is_active = 1
+'''
+
+USER_COLUMNS = 'user_id, username, first_name, joined_date, last_active'
+
+CHAT_COLUMNS = 'chat_id, chat_type, chat_title, joined_date, last_active, is_active'
+
+SQL_GET_USER = f'SELECT {USER_COLUMNS} FROM users WHERE user_id = ?'
+
+SQL_GET_CHAT = f'SELECT {CHAT_COLUMNS} FROM chats WHERE chat_id = ?'
+
+SQL_ACTIVE_CHATS = '''
+    SELECT chat_id, chat_type, chat_title
+    FROM chats
+    WHERE is_active = 1
+    ORDER BY last_active DESC
+'''
+
+SQL_DEACTIVATE_CHAT = '''
+    UPDATE chats
+    SET is_active = 0
+    WHERE chat_id = ?
+'''
+
+SQL_LOG_QUERY = '''
+    INSERT INTO query_logs (user_id, query, timestamp)
+    VALUES (?, ?, ?)
+'''
+
+SQL_IMPORT_QUERY = '''
+    INSERT INTO query_logs (user_id, query)
+    VALUES (?, ?)
+'''
+
+SQL_USER_STATS = '''
+    SELECT COALESCE(u.username, 'Unknown') as username,
+           u.joined_date,
+           (SELECT COUNT(*) FROM query_logs WHERE user_id = q.user_id) as query_count
+    FROM (SELECT ? as user_id) q
+    LEFT JOIN users u ON u.user_id = q.user_id
+'''
+
+SQL_ALL_USERS = 'SELECT * FROM users ORDER BY joined_date DESC'
+
+SQL_USER_COUNT = 'SELECT COUNT(*) as count FROM users'
+
+SQL_POPULAR_QUERIES = '''
+    SELECT query, count
+    FROM query_counts
+    ORDER BY count DESC
+    LIMIT ?
+'''
+
+SQL_TOTAL_QUERIES = 'SELECT COUNT(*) as count FROM query_logs'
+
 class Database:
     def __init__(self):
         self.db_path = os.getenv('DATABASE_PATH', 'bot_data.db')
+        
+        # One long-lived connection keeps SQLite's page cache warm between calls
+        self._conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, cached_statements=256
+        )
+        self._conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            self._conn.execute(pragma)
+        self._write_lock = threading.Lock()
+        atexit.register(self._conn.close)
+        
+        # Write-behind buffers for query logs and user touches, flushed in batches
+        self._log_buf = deque()
+        self._touch_buf = {}  # user_id -> latest (user_id, username, ts)
+        self._log_lock = threading.Lock()
+        atexit.register(self.flush_query_logs)
+        
         self.init_database()
     
     @contextmanager
     def get_connection(self):
-        """Context manager for database connections"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        try:
-            yield conn
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+        """Context manager for write transactions on the shared connection"""
+        with self._write_lock:
+            try:
+                yield self._conn
+                self._conn.commit()
+            except Exception as e:
+                self._conn.rollback()
+                raise e
     
     def init_database(self):
         """Initialize all database tables"""
         with self.get_connection() as conn:
+            # WAL lets readers proceed while a writer appends
+            conn.execute('PRAGMA journal_mode=WAL')
+            
+            # Skip the DDL when the stored schema is already current
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            
             cursor = conn.cursor()
+            cursor.execute('BEGIN')
+            
+            # Before v3 timestamps were stored as text; move those tables aside
+            legacy_tables = []
+            if version < 3:
+                cursor.execute('''
+                    SELECT name FROM sqlite_master
+                    WHERE type = 'table' AND name IN ('users', 'query_logs', 'chats')
+                ''')
+                legacy_tables = [row['name'] for row in cursor.fetchall()]
+                for table in legacy_tables:
+                    cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
             
             # Users table
             cursor.execute('''
@@ -33,8 +190,8 @@ class Database:
                     user_id INTEGER PRIMARY KEY,
                     username TEXT,
                     first_name TEXT,
-                    joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    joined_date INTEGER DEFAULT (strftime('%s', 'now')),
+                    last_active INTEGER DEFAULT (strftime('%s', 'now'))
                 )
             ''')
             
@@ -44,7 +201,7 @@ class Database:
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER,
                     query TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    timestamp INTEGER DEFAULT (strftime('%s', 'now')),
                     FOREIGN KEY (user_id) REFERENCES users(user_id)
                 )
             ''')
@@ -55,125 +212,153 @@ class Database:
                     chat_id INTEGER PRIMARY KEY,
                     chat_type TEXT,
                     chat_title TEXT,
-                    joined_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    joined_date INTEGER DEFAULT (strftime('%s', 'now')),
+                    last_active INTEGER DEFAULT (strftime('%s', 'now')),
                     is_active INTEGER DEFAULT 1
                 )
             ''')
             
+            for table in legacy_tables:
+                cursor.execute(EPOCH_MIGRATIONS[table])
+            for table in legacy_tables:
+                cursor.execute(f'DROP TABLE {table}_old')
+            
             # Create indexes
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON query_logs(user_id)')
+            # (user_id, timestamp) covers per-user counts; it supersedes idx_user_id
+            cursor.execute('DROP INDEX IF EXISTS idx_user_id')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_qlogs_user_ts ON query_logs(user_id, timestamp)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON query_logs(timestamp)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_active ON chats(is_active)')
+            
+            # Running per-query totals so popular queries skip the GROUP BY scan
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS query_counts (
+                    query TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_query_counts_count ON query_counts(count)')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_query_counts
+                AFTER INSERT ON query_logs
+                WHEN NEW.query IS NOT NULL
+                BEGIN
+                    INSERT INTO query_counts (query, count) VALUES (NEW.query, 1)
+                    ON CONFLICT(query) DO UPDATE SET count = count + 1;
+                END
+            ''')
+            
+            # Rebuild totals from existing logs
+            cursor.execute('DELETE FROM query_counts')
+            cursor.execute('''
+                INSERT INTO query_counts (query, count)
+                SELECT query, COUNT(*) FROM query_logs
+                WHERE query IS NOT NULL
+                GROUP BY query
+            ''')
+            
+            conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
     
     def add_user(self, user_id, username, first_name=None):
-        """Add or update user"""
+        """Add or update user; returns the stored row"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO users (user_id, username, first_name, last_active)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-                ON CONFLICT(user_id) DO UPDATE SET
-                    username = excluded.username,
-                    first_name = excluded.first_name,
-                    last_active = CURRENT_TIMESTAMP
-            ''', (user_id, username, first_name))
+            if SUPPORTS_RETURNING:
+                cursor.execute(f'{SQL_ADD_USER} RETURNING {USER_COLUMNS}',
+                               (user_id, username, first_name))
+            else:
+                cursor.execute(SQL_ADD_USER, (user_id, username, first_name))
+                cursor.execute(SQL_GET_USER, (user_id,))
+            return cursor.fetchone()
     
     def track_chat(self, chat_id, chat_type='group', chat_title=None):
-        """Track a group chat for automated postings"""
+        """Track a group chat for automated postings; returns the stored row"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO chats (chat_id, chat_type, chat_title, last_active)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-                ON CONFLICT(chat_id) DO UPDATE SET
-                    chat_type = excluded.chat_type,
-                    chat_title = excluded.chat_title,
-                    last_active = CURRENT_TIMESTAMP,
-                    is_active = 1
-            ''', (chat_id, chat_type, chat_title))
+            if SUPPORTS_RETURNING:
+                cursor.execute(f'{SQL_TRACK_CHAT} RETURNING {CHAT_COLUMNS}',
+                               (chat_id, chat_type, chat_title))
+            else:
+                cursor.execute(SQL_TRACK_CHAT, (chat_id, chat_type, chat_title))
+                cursor.execute(SQL_GET_CHAT, (chat_id,))
+            return cursor.fetchone()
     
     def get_active_chats(self):
         """Get all active group chats for automated postings"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT chat_id, chat_type, chat_title
-                FROM chats
-                WHERE is_active = 1
-                ORDER BY last_active DESC
-            ''')
-            return [dict(row) for row in cursor.fetchall()]
+        return self._conn.execute(SQL_ACTIVE_CHATS).fetchall()
     
     def deactivate_chat(self, chat_id):
-        """Deactivate a chat (e.g., when bot is removed)"""
+        """Deactivate a chat (e.g., when bot is removed); returns whether it was tracked"""
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE chats
-                SET is_active = 0
-                WHERE chat_id = ?
-            ''', (chat_id,))
+            return conn.execute(SQL_DEACTIVATE_CHAT, (chat_id,)).rowcount > 0
     
     def log_query(self, user_id, query):
-        """Log a user query"""
+        """Queue a user query; it is written on the next flush"""
+        with self._log_lock:
+            self._log_buf.append((user_id, query, int(time.time())))
+            full = len(self._log_buf) >= LOG_FLUSH_SIZE
+        if full:
+            self.flush_query_logs()
+    
+    def log_user_query(self, user_id, username, query):
+        """Queue a user upsert and their query; both are written on the next flush"""
+        with self._log_lock:
+            self._touch_buf[user_id] = (user_id, username, int(time.time()))
+        self.log_query(user_id, query)
+    
+    def flush_query_logs(self):
+        """Write all buffered user touches and query logs in a single transaction"""
+        with self._log_lock:
+            if not self._log_buf and not self._touch_buf:
+                return 0
+            rows, self._log_buf = self._log_buf, deque()
+            touches, self._touch_buf = self._touch_buf, {}
+        
+        try:
+            with self.get_connection() as conn:
+                conn.executemany(SQL_TOUCH_USER, touches.values())
+                conn.executemany(SQL_LOG_QUERY, rows)
+        except Exception:
+            # Put the rows back so the next flush retries them; newer touches win
+            with self._log_lock:
+                self._log_buf.extendleft(reversed(rows))
+                for user_id, touch in touches.items():
+                    self._touch_buf.setdefault(user_id, touch)
+            raise
+        return len(rows)
+    
+    def log_queries_bulk(self, rows):
+        """Insert (user_id, query) rows in one transaction; pass ~10k rows per call"""
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO query_logs (user_id, query)
-                VALUES (?, ?)
-            ''', (user_id, query))
+            conn.executemany(SQL_IMPORT_QUERY, rows)
     
     def get_user_stats(self, user_id):
         """Get user statistics"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Get user info
-            cursor.execute('''
-                SELECT username, joined_date
-                FROM users
-                WHERE user_id = ?
-            ''', (user_id,))
-            user_info = cursor.fetchone()
-            
-            # Get query count
-            cursor.execute('''
-                SELECT COUNT(*) as count
-                FROM query_logs
-                WHERE user_id = ?
-            ''', (user_id,))
-            query_count = cursor.fetchone()['count']
-            
-            return {
-                'username': user_info['username'] if user_info else 'Unknown',
-                'joined_date': user_info['joined_date'] if user_info else None,
-                'query_count': query_count
-            }
+        self.flush_query_logs()
+        return dict(self._conn.execute(SQL_USER_STATS, (user_id,)).fetchone())
     
     def get_all_users(self):
         """Get all users"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM users ORDER BY joined_date DESC')
-            return [dict(row) for row in cursor.fetchall()]
+        return list(self.iter_all_users())
+    
+    def iter_all_users(self, batch=500):
+        """Yield all users, fetching them from SQLite in batches"""
+        self.flush_query_logs()
+        cursor = self._conn.execute(SQL_ALL_USERS)
+        while rows := cursor.fetchmany(batch):
+            yield from rows
+    
+    def get_user_count(self):
+        """Get total number of users"""
+        self.flush_query_logs()
+        return self._conn.execute(SQL_USER_COUNT).fetchone()['count']
     
     def get_popular_queries(self, limit=10):
         """Get most popular queries"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT query, COUNT(*) as count
-                FROM query_logs
-                GROUP BY query
-                ORDER BY count DESC
-                LIMIT ?
-            ''', (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+        self.flush_query_logs()
+        return self._conn.execute(SQL_POPULAR_QUERIES, (limit,)).fetchall()
     
     def get_total_queries(self):
         """Get total number of queries"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) as count FROM query_logs')
-            return cursor.fetchone()['count']
+        self.flush_query_logs()
+        return self._conn.execute(SQL_TOTAL_QUERIES).fetchone()['count']
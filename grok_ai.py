@@ -1,74 +1,138 @@
 import os
-import requests
-import logging
-from concurrent.futures import ThreadPoolExecutor
+import time
+import random
 import asyncio
+import hashlib
+import logging
+import aiohttp
+import orjson
 
 logger = logging.getLogger(__name__)
 
 class GrokAI:
     """Grok AI integration - Non-blocking version"""
     
+    _BASE_PROMPT = """You are Eva Geises, a friendly Namibia AI assistant.
+Be warm, use emojis (🇳🇦, 🦁, 🏜️), keep responses short (2-3 sentences), mention /menu."""
+    _WELCOME_PROMPT = "You are Eva Geises, friendly Namibia AI. Keep it very brief."
+    _STARTER_PROMPT = "You are Eva Geises, friendly Namibia AI."
+    _STARTER_REQUEST = "Short Namibia fact or question for group chat. 1-2 sentences. Include emoji and /menu."
+    
+    STARTER_TTL = 600  # seconds a generated starter stays reusable
+    STARTER_POOL_SIZE = 4  # distinct starters kept before reusing them
+    BREAKER_THRESHOLD = 5  # consecutive failures before calls are skipped
+    BREAKER_COOLDOWN = 30  # seconds to skip calls once the breaker opens
+    
     def __init__(self):
         self.api_key = os.environ.get("GROK_API_KEY", "")
         self.api_url = "https://api.x.ai/v1/chat/completions"
         self.enabled = bool(self.api_key)
-        self.executor = ThreadPoolExecutor(max_workers=3)
+        self._session = None  # Shared keep-alive session, created on first use
+        self._starter_cache = []  # (created_at, text) pairs
+        self._inflight = {}  # request key -> Future shared by identical concurrent chats
+        self._consec_fail = 0
+        self._open_until = 0.0  # monotonic time until which requests fail fast
+        self._payload_prefixes = {}  # (system prompt, max_tokens, temperature) -> JSON bytes
         
         if self.enabled:
             logger.info("✅ Grok AI enabled")
         else:
             logger.info("ℹ️ Grok AI disabled - using fallback responses")
     
-    def _make_request(self, messages, max_tokens=500, temperature=0.7):
-        """Make synchronous request to Grok API"""
-        try:
-            response = requests.post(
-                self.api_url,
+    def _get_session(self):
+        """Get the shared HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
                 headers={
                     "Authorization": f"Bearer {self.api_key}",
                     "Content-Type": "application/json"
                 },
-                json={
-                    "model": "grok-beta",
-                    "messages": messages,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens
-                },
-                timeout=8  # Short timeout to not block
+                timeout=aiohttp.ClientTimeout(total=8)  # Short timeout to not block
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
+        return self._session
+    
+    def _build_payload(self, system_prompt, user_message, max_tokens, temperature, static=True):
+        """Serialize a request body, reusing the encoded shell for static prompts"""
+        key = (system_prompt, max_tokens, temperature)
+        prefix = self._payload_prefixes.get(key)
+        if prefix is None:
+            # Everything up to the system message, minus the closing "]}"
+            prefix = orjson.dumps({
+                "model": "grok-beta",
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "messages": [{"role": "system", "content": system_prompt}]
+            })[:-2]
+            if static:
+                self._payload_prefixes[key] = prefix
+        return prefix + b',{"role":"user","content":' + orjson.dumps(user_message) + b'}]}'
+    
+    async def _make_request(self, payload):
+        """Make request to Grok API over the shared session"""
+        # Fail fast while the API is known to be unhealthy
+        if time.monotonic() < self._open_until:
+            return None
+        
+        try:
+            async with self._get_session().post(
+                self.api_url,
+                data=payload
+            ) as response:
+                if response.status == 200:
+                    result = orjson.loads(await response.read())
+                    self._consec_fail = 0
+                    return result["choices"][0]["message"]["content"]
+                logger.debug(f"Grok request returned HTTP {response.status}")
         except Exception as e:
             logger.debug(f"Grok request failed: {e}")
         
+        self._record_failure()
         return None
     
+    def _record_failure(self):
+        """Count a failed request and open the breaker after too many in a row"""
+        self._consec_fail += 1
+        if self._consec_fail >= self.BREAKER_THRESHOLD:
+            self._open_until = time.monotonic() + self.BREAKER_COOLDOWN
+            self._consec_fail = 0
+            logger.info(f"⚠️ Grok unavailable - skipping requests for {self.BREAKER_COOLDOWN}s")
+    
+    def _build_system_prompt(self, context=None):
+        """Build the chat system prompt, adding KB context when available"""
+        if context and context.get('kb_results'):
+            return f"{self._BASE_PROMPT}\n\nContext: {context['kb_results'][0]['topic']}"
+        return self._BASE_PROMPT
+    
     async def chat(self, user_message, context=None):
         """Chat with Grok AI - Non-blocking"""
         if not self.enabled:
             return None
         
         try:
-            system_prompt = """You are Eva Geises, a friendly Namibia AI assistant.
-Be warm, use emojis (🇳🇦, 🦁, 🏜️), keep responses short (2-3 sentences), mention /menu."""
+            system_prompt = self._build_system_prompt(context)
+            key = hashlib.blake2b(
+                f"{system_prompt}\0{user_message}".encode(), digest_size=16
+            ).hexdigest()
             
-            if context and context.get('kb_results'):
-                system_prompt += f"\n\nContext: {context['kb_results'][0]['topic']}"
+            # An identical request is already in flight - share its answer
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                return await asyncio.shield(inflight)
             
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
-            
-            # Run in thread pool to not block event loop
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                self.executor,
-                lambda: self._make_request(messages, max_tokens=500, temperature=0.7)
-            )
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            try:
+                # Context-augmented prompts vary per call, so only the base prompt is cached
+                payload = self._build_payload(
+                    system_prompt, user_message, max_tokens=500, temperature=0.7,
+                    static=system_prompt is self._BASE_PROMPT
+                )
+                result = await self._make_request(payload)
+                future.set_result(result)
+            finally:
+                del self._inflight[key]
+                if not future.done():
+                    future.set_result(None)
             
             return result
             
@@ -83,17 +147,14 @@ Be warm, use emojis (🇳🇦, 🦁, 🏜️), keep responses short (2-3 sentenc
         
         try:
             greeting = time_of_day or "Hello"
-            messages = [
-                {"role": "system", "content": "You are Eva Geises, friendly Namibia AI. Keep it very brief."},
-                {"role": "user", "content": f"Welcome {member_name}. Use '{greeting}'. 2 sentences. Mention Eva and /menu. Include 🇳🇦"}
-            ]
-            
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                self.executor,
-                lambda: self._make_request(messages, max_tokens=100, temperature=0.8)
+            payload = self._build_payload(
+                self._WELCOME_PROMPT,
+                f"Welcome {member_name}. Use '{greeting}'. 2 sentences. Mention Eva and /menu. Include 🇳🇦",
+                max_tokens=100, temperature=0.8
             )
             
+            result = await self._make_request(payload)
+            
             return result
             
         except Exception as e:
@@ -106,26 +167,34 @@ Be warm, use emojis (🇳🇦, 🦁, 🏜️), keep responses short (2-3 sentenc
             return None
         
         try:
-            messages = [
-                {"role": "system", "content": "You are Eva Geises, friendly Namibia AI."},
-                {"role": "user", "content": "Short Namibia fact or question for group chat. 1-2 sentences. Include emoji and /menu."}
+            now = time.monotonic()
+            self._starter_cache = [
+                (created, text) for created, text in self._starter_cache
+                if now - created < self.STARTER_TTL
             ]
             
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                self.executor,
-                lambda: self._make_request(messages, max_tokens=80, temperature=0.9)
+            # Reuse a recent starter once the pool is full
+            if len(self._starter_cache) >= self.STARTER_POOL_SIZE:
+                return random.choice(self._starter_cache)[1]
+            
+            payload = self._build_payload(
+                self._STARTER_PROMPT, self._STARTER_REQUEST, max_tokens=80, temperature=0.9
             )
             
+            result = await self._make_request(payload)
+            
+            if result:
+                self._starter_cache.append((now, result))
+            elif self._starter_cache:
+                return random.choice(self._starter_cache)[1]
+            
             return result
             
         except Exception as e:
             logger.debug(f"Grok starter error: {e}")
             return None
     
-    def __del__(self):
-        """Cleanup executor"""
-        try:
-            self.executor.shutdown(wait=False)
-        except:
-            pass
\ No newline at end of file
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
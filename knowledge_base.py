@@ -1,94 +1,392 @@
 import os
+import atexit
+import asyncio
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from collections import OrderedDict
 import re
 import requests
 import csv
-import time
 import io
+import time
 from contextlib import contextmanager
 import logging
+from database import CONNECTION_PRAGMAS, SUPPORTS_RETURNING
 
 logger = logging.getLogger(__name__)
 
+# Barewords only; FTS5 operators and punctuation in user text would be a syntax error
+FTS_TOKEN = re.compile(r'\w+')
+
+KNOWLEDGE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS knowledge (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        content TEXT NOT NULL,
+        keywords TEXT,
+        source TEXT DEFAULT 'local',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        content_hash BLOB,
+        UNIQUE(topic, category)
+    )
+'''
+
+# (category, topic) serves get_by_category's filter and ORDER BY without a sort step
+KNOWLEDGE_INDEXES = (
+    'DROP INDEX IF EXISTS idx_knowledge_category',
+    'DROP INDEX IF EXISTS idx_knowledge_source',
+    'CREATE INDEX IF NOT EXISTS idx_knowledge_cat_topic ON knowledge(category, topic)',
+    # Covers the per-source key scans of the CSV diff without touching the rows
+    'CREATE INDEX IF NOT EXISTS idx_knowledge_source_key ON knowledge(source, topic, category)',
+)
+
+# Small key/value store for sync state that should survive restarts
+KB_META_SCHEMA = 'CREATE TABLE IF NOT EXISTS kb_meta (key TEXT PRIMARY KEY, value TEXT)'
+
+SQL_GET_META = 'SELECT value FROM kb_meta WHERE key = ?'
+
+SQL_SET_META = '''
+    INSERT INTO kb_meta (key, value) VALUES (?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+'''
+
+# Large CSV loads drop these and rebuild them once instead of updating them per row;
+# the UNIQUE(topic, category) index stays because the upsert depends on it
+SECONDARY_INDEX_DROPS = (
+    'DROP INDEX IF EXISTS idx_knowledge_cat_topic',
+    'DROP INDEX IF EXISTS idx_knowledge_source_key',
+)
+
+BULK_REINDEX_ROWS = 1000
+
+# Distinct (query, limit) results kept between knowledge changes
+SEARCH_CACHE_SIZE = 1024
+
+SQL_FTS_DEFINITION = "SELECT sql FROM sqlite_master WHERE name = 'knowledge_fts'"
+
+# Accepted CSV header names (matched case-insensitively) for topic, content,
+# category and keywords, in priority order
+CSV_COLUMNS = (
+    ('question', 'topic'),
+    ('answer', 'content'),
+    ('category',),
+    ('keyword', 'keywords'),
+)
+
+# Quote characters dropped from every CSV field
+STRIP_QUOTES = str.maketrans('', '', '"\'')
+
+# External-content FTS index: the text lives only in knowledge, triggers keep the index in step
+FTS_SCHEMA = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts
+    USING fts5(category, topic, content, keywords, content='knowledge', content_rowid='id',
+               tokenize='porter unicode61 remove_diacritics 2', prefix='2 3 4')
+'''
+
+FTS_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS knowledge_ai AFTER INSERT ON knowledge BEGIN
+        INSERT INTO knowledge_fts (rowid, category, topic, content, keywords)
+        VALUES (new.id, new.category, new.topic, new.content, new.keywords);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS knowledge_ad AFTER DELETE ON knowledge BEGIN
+        INSERT INTO knowledge_fts (knowledge_fts, rowid, category, topic, content, keywords)
+        VALUES ('delete', old.id, old.category, old.topic, old.content, old.keywords);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS knowledge_au AFTER UPDATE OF category, topic, content, keywords ON knowledge BEGIN
+        INSERT INTO knowledge_fts (knowledge_fts, rowid, category, topic, content, keywords)
+        VALUES ('delete', old.id, old.category, old.topic, old.content, old.keywords);
+        INSERT INTO knowledge_fts (rowid, category, topic, content, keywords)
+        VALUES (new.id, new.category, new.topic, new.content, new.keywords);
+    END
+    ''',
+)
+
+# Statements kept as constants so the connection's statement cache always hits
+# Seed rows an earlier CSV sync took over are reclaimed; local and manual rows are left alone
+SQL_INSERT_SEED = '''
+    INSERT INTO knowledge (category, topic, content, keywords, source)
+    VALUES (?, ?, ?, ?, 'local')
+    ON CONFLICT(topic, category) DO UPDATE SET
+        content = excluded.content,
+        keywords = excluded.keywords,
+        content_hash = NULL,
+        updated_at = CURRENT_TIMESTAMP,
+        source = 'local'
+    WHERE knowledge.source = 'csv'
+'''
+
+# Parsed CSV rows are staged per connection so the diff against knowledge runs in SQL
+SQL_CSV_STAGING = '''
+    CREATE TEMP TABLE IF NOT EXISTS csv_staging (
+        category TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        content TEXT NOT NULL,
+        keywords TEXT,
+        content_hash BLOB,
+        PRIMARY KEY (topic, category)
+    )
+'''
+
+# Later duplicates of a (topic, category) win, as they would with sequential upserts
+SQL_STAGE_CSV = "INSERT OR REPLACE INTO csv_staging VALUES (?, ?, ?, ?, ?)"
+
+SQL_CLEAR_STAGING = "DELETE FROM csv_staging"
+
+SQL_STAGING_PENDING = '''
+    SELECT
+        (SELECT COUNT(*) FROM csv_staging s
+         LEFT JOIN knowledge k ON k.topic = s.topic AND k.category = s.category
+         WHERE k.id IS NULL OR (k.source = 'csv' AND k.content_hash IS NOT s.content_hash)) AS changed,
+        (SELECT COUNT(*) FROM knowledge k
+         WHERE k.source = 'csv' AND NOT EXISTS (
+             SELECT 1 FROM csv_staging s WHERE s.topic = k.topic AND s.category = k.category
+         )) AS stale
+'''
+
+SQL_DELETE_CSV = '''
+    DELETE FROM knowledge
+    WHERE source = 'csv' AND NOT EXISTS (
+        SELECT 1 FROM csv_staging s WHERE s.topic = knowledge.topic AND s.category = knowledge.category
+    )
+'''
+
+SQL_UPSERT_CSV = '''
+    INSERT INTO knowledge (category, topic, content, keywords, content_hash, source)
+    SELECT category, topic, content, keywords, content_hash, 'csv' FROM csv_staging WHERE true
+    ON CONFLICT(topic, category) DO UPDATE SET
+        content = excluded.content,
+        keywords = excluded.keywords,
+        content_hash = excluded.content_hash,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE knowledge.source = 'csv' AND knowledge.content_hash IS NOT excluded.content_hash
+'''
+
+SQL_COUNT_LOCAL = "SELECT COUNT(*) FROM knowledge WHERE source = 'local'"
+
+SQL_HAS_DATA = 'SELECT 1 FROM knowledge LIMIT 1'
+
+# Rank and limit inside the FTS table first so the join only touches the top hits.
+# bm25 weights follow the column order: category, topic, content, keywords
+SQL_SEARCH_FTS = '''
+    WITH m AS (
+        SELECT rowid, bm25(knowledge_fts, 2.0, 5.0, 1.0, 3.0) AS score
+        FROM knowledge_fts
+        WHERE knowledge_fts MATCH ?
+        ORDER BY score
+        LIMIT ?
+    )
+    SELECT k.category, k.topic, k.content, k.keywords
+    FROM m
+    JOIN knowledge k ON k.id = m.rowid
+    ORDER BY m.score
+'''
+
+# Substring fallback: the lowered term is bound once and each column is tested once,
+# ranking topic hits before content hits
+SQL_SEARCH_LIKE = '''
+    SELECT category, topic, content, keywords
+    FROM (
+        SELECT category, topic, content, keywords,
+               instr(lower(topic), ?1) > 0 AS in_topic,
+               instr(lower(content), ?1) > 0 AS in_content,
+               instr(lower(keywords), ?1) > 0 AS in_keywords
+        FROM knowledge
+    )
+    WHERE in_topic OR in_content OR in_keywords
+    ORDER BY in_topic DESC, in_content DESC
+    LIMIT ?2
+'''
+
+# An upsert rather than INSERT OR REPLACE, whose implicit delete skips the FTS triggers
+SQL_ADD_KNOWLEDGE = '''
+    INSERT INTO knowledge (category, topic, content, keywords, source)
+    VALUES (?, ?, ?, ?, 'manual')
+    ON CONFLICT(topic, category) DO UPDATE SET
+        content = excluded.content,
+        keywords = excluded.keywords,
+        updated_at = CURRENT_TIMESTAMP,
+        source = 'manual'
+'''
+
+SQL_ADD_KNOWLEDGE_RETURNING = f'{SQL_ADD_KNOWLEDGE} RETURNING id'
+
+SQL_KNOWLEDGE_ID = 'SELECT id FROM knowledge WHERE topic = ? AND category = ?'
+
+SQL_ALL_TOPICS = 'SELECT DISTINCT topic FROM knowledge ORDER BY topic'
+
+SQL_BY_CATEGORY = '''
+    SELECT topic, content, keywords
+    FROM knowledge
+    WHERE category = ?
+    ORDER BY topic
+'''
+
+SQL_CATEGORIES = 'SELECT DISTINCT category FROM knowledge ORDER BY category'
+
+# Hot queries with sample arguments and the plan step each must use; checked at startup
+QUERY_PLAN_CHECKS = (
+    ('search', SQL_SEARCH_FTS, ('"namibia"', 5), 'VIRTUAL TABLE INDEX 0:M'),
+    ('topics by category', SQL_BY_CATEGORY, ('General',), 'USING INDEX idx_knowledge_cat_topic'),
+    ('categories', SQL_CATEGORIES, (), 'USING COVERING INDEX idx_knowledge_cat_topic'),
+)
+
 class KnowledgeBase:
     def __init__(self):
         self.db_path = os.getenv('DATABASE_PATH', 'bot_data.db')
         self.csv_url = 'https://gist.githubusercontent.com/nambili-samuel/a3bf79d67b2bd0c8d5aa9a830024417d/raw/36f6f55b9997c60ff825ddc806cee8dfd76916d7/namibia_knowledge_base.csv'
-        self.last_sync = 0
-        self.sync_interval = 10 * 60 * 1000  # 10 minutes in milliseconds
+        self.last_sync = None  # time.monotonic() of the last successful sync
+        self.sync_interval = 10 * 60  # 10 minutes
+        self._etag = None  # Validators from the last loaded CSV response
+        self._last_modified = None
+        self._http = requests.Session()  # Keeps the Gist connection alive between syncs
+        
+        # One long-lived connection per thread, so the sync thread's writes
+        # never hold up reads on the bot's thread (WAL lets them run side by side)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()  # Guards _connections and _sync_thread
+        self._sync_lock = threading.Lock()  # Coalesces overlapping CSV syncs
+        self._sync_thread = None  # Started by start_background_sync
+        self._search_cache = OrderedDict()  # (query, limit) -> rows, least recent first
+        self._cache_lock = threading.Lock()
+        self._list_cache = {}  # SQL -> topic/category list read at the current generation
+        self._generation = 0  # Bumped whenever knowledge rows change
+        self._has_data = False  # Set once rows are seen; re-probed after changes
+        # Async callers run queries here so SQLite I/O never blocks the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='kbdb')
+        atexit.register(self.close)
         
         self.init_knowledge_base()
         self.seed_namibia_data()
-        
-        # Sync with CSV after seeding local data
-        try:
-            logger.info("🔄 Attempting initial CSV sync...")
-            self.sync_with_csv()
-        except Exception as e:
-            logger.error(f"❌ Initial CSV sync failed: {e}")
+        self.create_indexes()  # After seeding, so a first run builds them in one pass
+        self.check_query_plans()
+    
+    def start_background_sync(self):
+        """Start the periodic CSV sync thread, once, so reads never wait on HTTP"""
+        with self._lock:
+            if self._sync_thread is None:
+                self._sync_thread = threading.Thread(target=self._sync_loop, name="kb-sync", daemon=True)
+                self._sync_thread.start()
+    
+    def _sync_loop(self):
+        """Sync with the CSV at startup and then every sync_interval"""
+        logger.info("🔄 Attempting initial CSV sync...")
+        while True:
+            try:
+                self.sync_with_csv()
+            except Exception as e:
+                logger.error(f"❌ Background CSV sync failed: {e}")
+            time.sleep(self.sync_interval)
+    
+    def _thread_connection(self):
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path, check_same_thread=False, cached_statements=256
+            )
+            conn.row_factory = sqlite3.Row
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
     
     @contextmanager
     def get_connection(self):
-        """Context manager for database connections"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        """Context manager for a transaction on this thread's connection"""
+        conn = self._thread_connection()
         try:
             yield conn
             conn.commit()
         except Exception as e:
             conn.rollback()
             raise e
-        finally:
-            conn.close()
+    
+    def close(self):
+        """Let SQLite refresh its planner statistics, then close every connection"""
+        self._http.close()
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.execute('PRAGMA optimize')
+                except sqlite3.Error as e:
+                    logger.debug(f"PRAGMA optimize skipped: {e}")
+                conn.close()
+            self._connections.clear()
     
     def init_knowledge_base(self):
         """Initialize knowledge base table"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS knowledge (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    category TEXT NOT NULL,
-                    topic TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    keywords TEXT,
-                    source TEXT DEFAULT 'local',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(topic, category)
-                )
-            ''')
+            # Persistent in the database file, so readers never wait on the CSV sync writer
+            cursor.execute('PRAGMA journal_mode=WAL')
             
-            # Create full-text search virtual table
-            cursor.execute('''
-                CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts 
-                USING fts5(category, topic, content, keywords)
-            ''')
+            cursor.execute(KNOWLEDGE_SCHEMA)
+            cursor.execute(KB_META_SCHEMA)
+            
+            # Tables from before change tracking lack the hash; NULL forces one full resync
+            columns = [row['name'] for row in cursor.execute('PRAGMA table_info(knowledge)')]
+            if 'content_hash' not in columns:
+                cursor.execute('ALTER TABLE knowledge ADD COLUMN content_hash BLOB')
+            
+            # Older databases kept a second copy of the text in a standalone FTS table,
+            # or indexed it without stemming or prefix indexes
+            cursor.execute(SQL_FTS_DEFINITION)
+            existing = cursor.fetchone()
+            rebuild = existing is None or any(
+                option not in existing['sql'] for option in ('content=', 'porter', 'prefix=')
+            )
+            if rebuild:
+                cursor.execute('DROP TABLE IF EXISTS knowledge_fts')
             
-            # Create index
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_knowledge_category 
-                ON knowledge(category)
-            ''')
+            # Create full-text search virtual table
+            cursor.execute(FTS_SCHEMA)
+            for trigger in FTS_TRIGGERS:
+                cursor.execute(trigger)
+            if rebuild:
+                cursor.execute("INSERT INTO knowledge_fts (knowledge_fts) VALUES ('rebuild')")
             
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_knowledge_source 
-                ON knowledge(source)
-            ''')
+            # Validators of the CSV already loaded, so a restart can get a 304 too
+            self._etag = self._get_meta(cursor, 'csv_etag')
+            self._last_modified = self._get_meta(cursor, 'csv_last_modified')
             
             logger.info("✅ Database initialized")
     
+    @staticmethod
+    def _get_meta(cursor, key):
+        """Read one kb_meta value, or None"""
+        row = cursor.execute(SQL_GET_META, (key,)).fetchone()
+        return row['value'] if row else None
+    
+    def create_indexes(self):
+        """Create secondary indexes once the initial rows are in"""
+        with self.get_connection() as conn:
+            for index in KNOWLEDGE_INDEXES:
+                conn.execute(index)
+    
+    def check_query_plans(self):
+        """Warn if a hot query no longer uses the index it was written for"""
+        conn = self._thread_connection()
+        for name, sql, args, expected in QUERY_PLAN_CHECKS:
+            plan = ' | '.join(row['detail'] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', args))
+            if expected not in plan:
+                logger.warning(f"⚠️ Query plan for {name} lacks '{expected}': {plan}")
+    
     def seed_namibia_data(self):
         """Seed Namibia knowledge base including real estate"""
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Check if local data exists
-            cursor.execute("SELECT COUNT(*) as count FROM knowledge WHERE source = 'local'")
-            if cursor.fetchone()['count'] > 0:
-                return
-            
             # Namibia knowledge data
             namibia_data = [
                 # REAL ESTATE PROPERTIES
@@ -143,191 +441,147 @@ class KnowledgeBase:
                 ('Facts', 'Economy', 'Namibia\'s economy is a lower-middle-income country driven by mining (diamonds, uranium), agriculture, and tourism, but it struggles with high inequality (second-highest Gini coefficient globally) and unemployment despite significant progress.', 'conservation, environment, protected'),
             ]
             
-            for category, topic, content, keywords in namibia_data:
-                cursor.execute('''
-                    INSERT OR IGNORE INTO knowledge (category, topic, content, keywords, source)
-                    VALUES (?, ?, ?, ?, 'local')
-                ''', (category, topic, content, keywords))
-                
-                if cursor.rowcount > 0:
-                    knowledge_id = cursor.lastrowid
-                    
-                    cursor.execute('''
-                        INSERT INTO knowledge_fts (rowid, category, topic, content, keywords)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (knowledge_id, category, topic, content, keywords))
+            # Skip when every seed row is present; otherwise restore the missing ones
+            if conn.execute(SQL_COUNT_LOCAL).fetchone()[0] >= len(namibia_data):
+                return
+            
+            seeded = conn.executemany(SQL_INSERT_SEED, namibia_data).rowcount
             
-            logger.info(f"✅ Seeded {len(namibia_data)} local topics including real estate")
+            logger.info(f"✅ Seeded {seeded} local topics including real estate")
     
     def sync_with_csv(self):
         """Sync database with CSV file from GitHub Gist"""
+        if not self._sync_lock.acquire(blocking=False):
+            logger.debug("📚 CSV sync already in progress")
+            return True
+        try:
+            return self._sync_with_csv()
+        finally:
+            self._sync_lock.release()
+    
+    def _sync_with_csv(self):
+        """Fetch the CSV and load it; callers hold the sync lock"""
         try:
-            current_time = time.time() * 1000
+            current_time = time.monotonic()
             
             # Check if we need to sync
-            if self.has_data() and (current_time - self.last_sync < self.sync_interval):
+            if (self.last_sync is not None and self.has_data()
+                    and current_time - self.last_sync < self.sync_interval):
                 logger.debug("📚 Using cached knowledge base")
                 return True
             
             logger.info(f"📥 Fetching knowledge base from: {self.csv_url}")
             
-            # Fetch CSV from URL with timeout
-            response = requests.get(self.csv_url, timeout=30)
-            response.raise_for_status()
+            # Only download the CSV again if it changed since the last load
+            headers = {}
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
             
-            # Parse CSV content
-            csv_text = response.text
-            logger.debug(f"📄 CSV size: {len(csv_text)} characters")
-            
-            csv_data = []
-            csv_file = io.StringIO(csv_text)
-            
-            try:
-                reader = csv.DictReader(csv_file)
-                logger.info(f"📋 CSV headers detected: {reader.fieldnames}")
+            # Fetch CSV from URL with timeout, parsing it as the body streams in
+            with self._http.get(self.csv_url, timeout=30, stream=True, headers=headers) as response:
+                if response.status_code == 304:
+                    logger.debug("📚 CSV unchanged since last sync")
+                    self.last_sync = current_time
+                    return True
+                response.raise_for_status()
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
                 
-                for row_num, row in enumerate(reader, 1):
-                    try:
-                        # Map CSV columns to database structure
-                        # CSV has: Question, Answer, Category, Keyword
-                        # We need: topic, content, category, keywords
-                        
-                        topic = ''
-                        content = ''
-                        category = 'General'
-                        keywords = ''
-                        
-                        # Try different possible column names
-                        if 'Question' in row:
-                            topic = row['Question'].strip()
-                        elif 'question' in row:
-                            topic = row['question'].strip()
-                        elif 'topic' in row:
-                            topic = row['topic'].strip()
-                        elif 'Topic' in row:
-                            topic = row['Topic'].strip()
-                        
-                        if 'Answer' in row:
-                            content = row['Answer'].strip()
-                        elif 'answer' in row:
-                            content = row['answer'].strip()
-                        elif 'content' in row:
-                            content = row['content'].strip()
-                        elif 'Content' in row:
-                            content = row['Content'].strip()
-                        
-                        if 'Category' in row:
-                            category = row['Category'].strip()
-                        elif 'category' in row:
-                            category = row['category'].strip()
-                        
-                        if 'Keyword' in row:
-                            keywords = row['Keyword'].strip()
-                        elif 'keyword' in row:
-                            keywords = row['keyword'].strip()
-                        elif 'Keywords' in row:
-                            keywords = row['Keywords'].strip()
-                        elif 'keywords' in row:
-                            keywords = row['keywords'].strip()
-                        
-                        # Clean and validate
-                        if not topic:
-                            topic = f"Topic_{row_num}"
-                        if not content:
-                            content = "No content available"
-                        if not category:
-                            category = "General"
-                        
-                        # Remove quotes and clean up
-                        topic = topic.replace('"', '').replace("'", "").strip()
-                        content = content.replace('"', '').replace("'", "").strip()
-                        category = category.replace('"', '').replace("'", "").strip()
-                        keywords = keywords.replace('"', '').replace("'", "").strip()
-                        
-                        csv_data.append({
-                            'topic': topic,
-                            'content': content,
-                            'category': category,
-                            'keywords': keywords
-                        })
-                        
-                        if row_num <= 3:  # Log first few rows
-                            logger.debug(f"📝 Row {row_num}: {topic[:50]}... -> {category}")
+                csv_data = []
+                response.raw.decode_content = True  # Undo any gzip transfer encoding
+                
+                try:
+                    reader = csv.reader(io.TextIOWrapper(response.raw, encoding='utf-8-sig', newline=''))
+                    header = next(reader, [])
+                    logger.info(f"📋 CSV headers detected: {header}")
+                    
+                    # Resolve each field's column once, then read rows by position
+                    columns = [name.strip().lower() for name in header]
+                    ti, ci, cat_i, ki = (
+                        next((columns.index(name) for name in names if name in columns), None)
+                        for names in CSV_COLUMNS
+                    )
+                    
+                    # Checked once so production syncs never format the sample rows
+                    log_rows = logger.isEnabledFor(logging.DEBUG)
+                    row_num = 0
+                    for row in reader:
+                        if not row:
+                            continue
+                        row_num += 1
+                        try:
+                            width = len(row)
+                            topic = row[ti].strip() if ti is not None and ti < width else ''
+                            content = row[ci].strip() if ci is not None and ci < width else ''
+                            category = row[cat_i].strip() if cat_i is not None and cat_i < width else ''
+                            keywords = row[ki].strip() if ki is not None and ki < width else ''
+                            
+                            # Clean and validate
+                            if not topic:
+                                topic = f"Topic_{row_num}"
+                            if not content:
+                                content = "No content available"
+                            if not category:
+                                category = "General"
+                            
+                            # Remove quotes and clean up
+                            topic = topic.translate(STRIP_QUOTES).strip()
+                            content = content.translate(STRIP_QUOTES).strip()
+                            category = category.translate(STRIP_QUOTES).strip()
+                            keywords = keywords.translate(STRIP_QUOTES).strip()
+                            
+                            csv_data.append((category, topic, content, keywords))
                             
-                    except Exception as row_error:
-                        logger.warning(f"⚠️ Error parsing row {row_num}: {row_error}")
-                        continue
+                            if row_num <= 3 and log_rows:  # Log first few rows
+                                logger.debug(f"📝 Row {row_num}: {topic[:50]}... -> {category}")
+                            
+                        except Exception as row_error:
+                            logger.warning(f"⚠️ Error parsing row {row_num}: {row_error}")
+                            continue
                         
-            except csv.Error as csv_error:
-                logger.error(f"❌ CSV parsing error: {csv_error}")
-                return False
+                except csv.Error as csv_error:
+                    logger.error(f"❌ CSV parsing error: {csv_error}")
+                    return False
             
             if not csv_data:
                 logger.warning("⚠️ No data parsed from CSV")
                 return False
             
-            # Insert/update data in database
+            # Stage the parsed rows, then diff and apply them in SQL within one transaction
             with self.get_connection() as conn:
-                cursor = conn.cursor()
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute(SQL_CSV_STAGING)
+                conn.executemany(SQL_STAGE_CSV, (
+                    (category, topic, content, keywords, hashlib.blake2b(
+                        f"{topic}\0{content}\0{keywords}".encode(), digest_size=8
+                    ).digest())
+                    for category, topic, content, keywords in csv_data
+                ))
+                changed, stale = conn.execute(SQL_STAGING_PENDING).fetchone()
+                bulk = changed + stale >= BULK_REINDEX_ROWS
+                if bulk:
+                    for drop in SECONDARY_INDEX_DROPS:
+                        conn.execute(drop)
+                conn.execute(SQL_DELETE_CSV)
+                conn.execute(SQL_UPSERT_CSV)
+                conn.execute(SQL_CLEAR_STAGING)
+                if bulk:
+                    for index in KNOWLEDGE_INDEXES:
+                        conn.execute(index)
+                # Stored with the rows so the validators always describe what is loaded
+                conn.executemany(SQL_SET_META, (('csv_etag', etag),
+                                                ('csv_last_modified', last_modified)))
+                # Refresh planner statistics whenever the row set actually moved
+                if changed or stale:
+                    conn.execute('ANALYZE knowledge')
                 
-                added = 0
-                updated = 0
-                
-                for entry in csv_data:
-                    try:
-                        # Check if entry exists
-                        cursor.execute('''
-                            SELECT id FROM knowledge 
-                            WHERE topic = ? AND category = ?
-                        ''', (entry['topic'], entry['category']))
-                        
-                        existing = cursor.fetchone()
-                        
-                        if existing:
-                            # Update existing entry
-                            cursor.execute('''
-                                UPDATE knowledge 
-                                SET content = ?, keywords = ?, 
-                                    updated_at = CURRENT_TIMESTAMP,
-                                    source = 'csv'
-                                WHERE id = ?
-                            ''', (entry['content'], entry['keywords'], existing['id']))
-                            
-                            # Update FTS
-                            cursor.execute('''
-                                DELETE FROM knowledge_fts WHERE rowid = ?
-                            ''', (existing['id'],))
-                            
-                            cursor.execute('''
-                                INSERT INTO knowledge_fts (rowid, category, topic, content, keywords)
-                                VALUES (?, ?, ?, ?, ?)
-                            ''', (existing['id'], entry['category'], entry['topic'], 
-                                  entry['content'], entry['keywords']))
-                            
-                            updated += 1
-                        else:
-                            # Insert new entry
-                            cursor.execute('''
-                                INSERT INTO knowledge (category, topic, content, keywords, source)
-                                VALUES (?, ?, ?, ?, 'csv')
-                            ''', (entry['category'], entry['topic'], entry['content'], entry['keywords']))
-                            
-                            knowledge_id = cursor.lastrowid
-                            
-                            cursor.execute('''
-                                INSERT INTO knowledge_fts (rowid, category, topic, content, keywords)
-                                VALUES (?, ?, ?, ?, ?)
-                            ''', (knowledge_id, entry['category'], entry['topic'], 
-                                  entry['content'], entry['keywords']))
-                            
-                            added += 1
-                            
-                    except Exception as insert_error:
-                        logger.error(f"❌ Error inserting {entry['topic']}: {insert_error}")
-                        continue
-                
-                logger.info(f"✅ CSV sync complete: {added} added, {updated} updated")
+                logger.info(f"✅ CSV sync complete: {changed} changed, {stale} removed")
             
+            if changed or stale:
+                self._invalidate_caches()
+            self._etag, self._last_modified = etag, last_modified
             self.last_sync = current_time
             return True
             
@@ -340,117 +594,139 @@ class KnowledgeBase:
     
     def has_data(self):
         """Check if database has any data"""
+        if self._has_data:
+            return True
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('SELECT COUNT(*) as count FROM knowledge')
-                return cursor.fetchone()['count'] > 0
+            self._has_data = self._thread_connection().execute(SQL_HAS_DATA).fetchone() is not None
         except:
             return False
+        return self._has_data
+    
+    @staticmethod
+    def _sanitize_fts(query, prefix=False):
+        """Turn free text into an OR of quoted FTS5 terms"""
+        suffix = '*' if prefix else ''
+        return ' OR '.join(f'"{term}"{suffix}' for term in FTS_TOKEN.findall(query.lower()))
+    
+    @property
+    def generation(self):
+        """Counter that changes whenever knowledge rows change"""
+        return self._generation
     
-    def ensure_data(self):
-        """Ensure we have data, sync if needed"""
-        if not self.has_data():
-            logger.warning("⚠️ No data in database, attempting sync...")
-            self.sync_with_csv()
+    def _invalidate_caches(self):
+        """Drop cached reads after the knowledge rows changed"""
+        with self._cache_lock:
+            self._generation += 1
+            self._search_cache.clear()
+            self._list_cache.clear()
+            self._has_data = False
     
     def search(self, query, limit=5):
-        """Search the knowledge base"""
-        # Ensure we have data and auto-sync if needed
-        self.ensure_data()
+        """Search the knowledge base, answering repeated questions from the LRU cache"""
+        # Normalized once so the cache key and the executed query always agree
+        query = query.lower().strip()
+        key = (query, limit)
+        with self._cache_lock:
+            results = self._search_cache.get(key)
+            if results is not None:
+                self._search_cache.move_to_end(key)
+                return results
+            generation = self._generation
         
-        try:
-            # Try to sync in background (non-blocking)
-            current_time = time.time() * 1000
-            if (current_time - self.last_sync) >= self.sync_interval:
-                self.sync_with_csv()
-        except:
-            pass  # Don't block search if sync fails
+        results = self._search(query, limit)
         
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Clean and prepare search query
-            search_terms = query.lower().strip().split()
-            search_query = ' OR '.join(search_terms)
-            
-            # Try FTS search first
-            cursor.execute('''
-                SELECT k.category, k.topic, k.content, k.keywords
-                FROM knowledge_fts f
-                JOIN knowledge k ON k.id = f.rowid
-                WHERE knowledge_fts MATCH ?
-                ORDER BY rank
-                LIMIT ?
-            ''', (search_query, limit))
-            
-            results = cursor.fetchall()
-            
-            # Fallback to LIKE search
-            if not results:
-                search_pattern = f'%{query}%'
-                cursor.execute('''
-                    SELECT category, topic, content, keywords
-                    FROM knowledge
-                    WHERE topic LIKE ? OR content LIKE ? OR keywords LIKE ?
-                    ORDER BY 
-                        CASE 
-                            WHEN topic LIKE ? THEN 1
-                            WHEN content LIKE ? THEN 2
-                            ELSE 3
-                        END
-                    LIMIT ?
-                ''', (search_pattern, search_pattern, search_pattern, 
-                      search_pattern, search_pattern, limit))
-                results = cursor.fetchall()
-            
-            return [dict(row) for row in results]
+        with self._cache_lock:
+            # Skip caching if a sync or add landed while the query ran
+            if generation == self._generation:
+                self._search_cache[key] = results
+                if len(self._search_cache) > SEARCH_CACHE_SIZE:
+                    self._search_cache.popitem(last=False)
+        return results
+    
+    def _search(self, query, limit):
+        """Run the FTS, prefix and LIKE searches for an already normalized query"""
+        # Reads run outside a transaction on this thread's connection
+        conn = self._thread_connection()
+        
+        # Clean and prepare search query
+        search_query = self._sanitize_fts(query)
+        results = []
+        
+        # Try FTS search first
+        if search_query:
+            results = conn.execute(SQL_SEARCH_FTS, (search_query, limit)).fetchall()
+        
+        # Retry as prefix queries so partial words still hit the FTS index
+        if search_query and not results:
+            prefix_query = self._sanitize_fts(query, prefix=True)
+            results = conn.execute(SQL_SEARCH_FTS, (prefix_query, limit)).fetchall()
+        
+        # Fallback to a substring scan
+        if not results:
+            results = conn.execute(SQL_SEARCH_LIKE, (query, limit)).fetchall()
+        
+        return results
     
     def add_knowledge(self, topic, content, category='General', keywords=''):
-        """Add new knowledge entry"""
+        """Add new knowledge entry; returns its id"""
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO knowledge (category, topic, content, keywords, source)
-                VALUES (?, ?, ?, ?, 'manual')
-            ''', (category, topic, content, keywords))
-            
-            knowledge_id = cursor.lastrowid
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO knowledge_fts (rowid, category, topic, content, keywords)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (knowledge_id, category, topic, content, keywords))
+            if SUPPORTS_RETURNING:
+                row = conn.execute(SQL_ADD_KNOWLEDGE_RETURNING, (category, topic, content, keywords)).fetchone()
+            else:
+                # lastrowid is not reliable when the upsert took the UPDATE path
+                conn.execute(SQL_ADD_KNOWLEDGE, (category, topic, content, keywords))
+                row = conn.execute(SQL_KNOWLEDGE_ID, (topic, category)).fetchone()
+            knowledge_id = row['id']
+        self._invalidate_caches()
+        return knowledge_id
+    
+    def _cached_column(self, sql, column):
+        """Read one column of a listing query, reusing it until the rows change"""
+        with self._cache_lock:
+            values = self._list_cache.get(sql)
+            if values is not None:
+                return list(values)
+            generation = self._generation
+        
+        values = [row[column] for row in self._thread_connection().execute(sql)]
+        
+        with self._cache_lock:
+            if generation == self._generation:
+                self._list_cache[sql] = values
+        return list(values)
     
     def get_all_topics(self):
         """Get all available topics"""
-        self.ensure_data()
-        
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT DISTINCT topic FROM knowledge ORDER BY topic')
-            return [row['topic'] for row in cursor.fetchall()]
+        return self._cached_column(SQL_ALL_TOPICS, 'topic')
     
     def get_by_category(self, category):
         """Get all topics in a category"""
-        self.ensure_data()
-        
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT topic, content, keywords
-                FROM knowledge
-                WHERE category = ?
-                ORDER BY topic
-            ''', (category,))
-            return [dict(row) for row in cursor.fetchall()]
+        return self._thread_connection().execute(SQL_BY_CATEGORY, (category,)).fetchall()
     
     def get_categories(self):
         """Get all categories"""
-        self.ensure_data()
-        
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT DISTINCT category FROM knowledge ORDER BY category')
-            return [row['category'] for row in cursor.fetchall()]
+        return self._cached_column(SQL_CATEGORIES, 'category')
+    
+    async def _run(self, func, *args):
+        """Run a knowledge base call on the worker thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    async def search_async(self, query, limit=5):
+        """Search the knowledge base without blocking the event loop"""
+        return await self._run(self.search, query, limit)
+    
+    async def add_knowledge_async(self, topic, content, category='General', keywords=''):
+        """Add new knowledge entry without blocking the event loop"""
+        return await self._run(self.add_knowledge, topic, content, category, keywords)
+    
+    async def get_all_topics_async(self):
+        """Get all available topics without blocking the event loop"""
+        return await self._run(self.get_all_topics)
+    
+    async def get_by_category_async(self, category):
+        """Get all topics in a category without blocking the event loop"""
+        return await self._run(self.get_by_category, category)
+    
+    async def get_categories_async(self):
+        """Get all categories without blocking the event loop"""
+        return await self._run(self.get_categories)
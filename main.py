@@ -4,7 +4,7 @@ import random
 import re
 import asyncio
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.error import TimedOut, NetworkError
 from telegram.ext import (
@@ -36,6 +36,184 @@ if not TELEGRAM_BOT_TOKEN:
 ADMIN_IDS_STR = os.environ.get("ADMIN_IDS", "")
 ADMIN_IDS = set(map(int, ADMIN_IDS_STR.split(','))) if ADMIN_IDS_STR else set()
 
+# =========================================================
+# MESSAGE MATCHING
+# =========================================================
+# Keyword lists are built once at import instead of on every message
+BOT_MENTIONS = ("@eva", "eva", "@namibiabot", "namibia bot", "hey bot", "hello bot", "hey eva")
+QUESTION_WORDS = ("what", "how", "where", "when", "why", "who", "which",
+                  "can you", "tell me", "explain", "show me", "is", "are", "do", "does")
+GREETING_WORDS = frozenset({"hi", "hello", "hey", "moro", "greetings", "hallo", "howzit"})
+REAL_ESTATE_KEYWORDS = ("house", "property", "land", "plot", "sale", "buy",
+                        "real estate", "windhoek west", "omuthiya", "okahandja",
+                        "bedroom", "bedroomed", "rent", "invest")
+TOPIC_KEYWORDS = ("etosha", "sossusvlei", "swakopmund", "windhoek", "himba", "herero",
+                  "desert", "dunes", "fish river", "cheetah", "elephant", "lion", "wildlife",
+                  "safari", "namib", "capital", "visa", "currency", "weather")
+TRAVEL_KEYWORDS = ("travel", "tour", "visit", "trip", "vacation", "holiday",
+                   "destination", "tourist", "booking")
+
+def keyword_pattern(words):
+    """Compile literal keywords into one alternation, so a message is scanned once"""
+    return re.compile('|'.join(re.escape(word) for word in words))
+
+BOT_MENTION_RE = keyword_pattern(BOT_MENTIONS)
+REAL_ESTATE_RE = keyword_pattern(REAL_ESTATE_KEYWORDS)
+TOPIC_RE = keyword_pattern(TOPIC_KEYWORDS)
+TRAVEL_RE = keyword_pattern(TRAVEL_KEYWORDS)
+
+def greeting_for_hour(hour):
+    """Time-appropriate greeting for an hour of the day"""
+    if 5 <= hour < 12:
+        return "Good morning"
+    elif 12 <= hour < 17:
+        return "Good afternoon"
+    elif 17 <= hour < 21:
+        return "Good evening"
+    else:
+        return "Hello"
+
+# Looked up by the local hour, so a greeting costs no datetime or branching
+GREETING_BY_HOUR = tuple(greeting_for_hour(hour) for hour in range(24))
+
+# Strip @handles and "hey eva"-style openers before searching
+MENTION_RE = re.compile(r'@[^\s]*')
+BOT_GREETING_RE = re.compile(r'(hey|hello|hi)\s+(eva|bot|namibia)')
+
+# =========================================================
+# RESPONSE TEXT
+# =========================================================
+# Fixed replies are built once at import; those that open with the time-of-day
+# greeting are prepared for each of its values and looked up by greeting
+MENU_TEXT = "🇳🇦 *I am here to help learn Namibia*\n\nWhat would you like to explore?"
+
+GROUP_WELCOME_TEMPLATE = """🇳🇦 *Eva Geises - Namibia Expert Bot*
+
+{greeting} everyone! I'm Eva Geises, your AI-powered Namibia assistant! 🦁
+
+*I can help with:*
+• Real Estate Properties 🏠
+• Tourism & Travel Planning 🏞️
+• Wildlife & Safari Info 🦓
+• Cultural Insights & History 👥
+• Practical Travel Advice ℹ️
+• Geography & Quick Facts 🗺️
+
+*How to use me:*
+• Ask questions naturally - I understand!
+• Mention "Namibia" - I'll join in!
+• Use /menu for organized topics
+• I respond to greetings warmly!
+• I welcome new members automatically!
+
+*Try asking:*
+• "Where is Namibia?"
+• "Tell me about Etosha"
+• "What properties are for sale?"
+• "Best time to visit?"
+
+*Quick Commands:*
+/menu - Browse categories 📚
+/properties - View real estate 🏠
+/topics - List all topics 📋
+/stats - Your statistics 📊
+/help - Help info 🆘
+
+🇳🇦 Let's explore Namibia together! 🏜️"""
+
+GROUP_WELCOME_TEXT = {greeting: GROUP_WELCOME_TEMPLATE.format(greeting=greeting)
+                      for greeting in set(GREETING_BY_HOUR)}
+
+HELP_TEMPLATE = """🆘 *Eva Geises - Help*
+
+{greeting}! I'm Eva, your AI Namibia expert! 🇳🇦
+
+*What I know:*
+• Real estate properties 🏠
+• Tourism & destinations 🏞️
+• Wildlife & safaris 🦁
+• Culture & people 👥
+• History & heritage 📜
+• Practical travel info ℹ️
+• Geography & facts 🗺️
+
+*How to use me:*
+• Ask natural questions
+• Use /menu for categories
+• I respond to greetings!
+• I join Namibia discussions!
+
+*Examples:*
+"Where is Namibia?"
+"Tell me about Etosha"
+"What properties for sale?"
+"Best time to visit?"
+
+*Commands:*
+/menu - Categories 📚
+/properties - Real estate 🏠
+/topics - All topics 📋
+/stats - Statistics 📊
+/help - This message 🆘
+
+🇳🇦 Ask me anything! 🦁"""
+
+HELP_TEXT = {greeting: HELP_TEMPLATE.format(greeting=greeting) for greeting in set(GREETING_BY_HOUR)}
+
+GREETING_REPLIES = {
+    greeting: (
+        f"👋 {greeting}! How can I help you explore Namibia today?\n\n📱 Use /menu to browse topics!",
+        f"🇳🇦 {greeting}! What would you like to know about Namibia?\n\n💡 Try /menu for categories!",
+        f"🦁 {greeting}! I'm Eva, your Namibia guide. Ask away!\n\n📚 Check /menu for all topics!",
+        f"🏜️ {greeting}! Ready to discover Namibia?\n\n✨ Use /menu to explore!",
+    )
+    for greeting in set(GREETING_BY_HOUR)
+}
+
+CONVERSATION_STARTERS = (
+    "💭 *Question for everyone:* What's your dream Namibia destination?\n\n📱 Use /menu to explore destinations!",
+    "🦁 *Wildlife talk:* Who has been on safari in Namibia?\n\n🦓 Check /menu → Wildlife for more!",
+    "🏜️ *Fun fact:* The Namib Desert is 55-80 million years old!\n\n📚 Use /menu for more Namibia facts!",
+    "👥 *Cultural question:* What interests you about Namibia's people?\n\n💡 Try /menu → Culture!",
+    "🗺️ *Travel tip:* Best time to visit is May-October!\n\n✈️ Use /menu → Tourism for planning!",
+    "🌅 *Amazing:* Sossusvlei has the world's highest dunes!\n\n📖 Discover more with /menu!",
+)
+
+def periodic_greetings_for_hour(hour):
+    """Periodic group greetings suited to an hour of the day"""
+    if 5 <= hour < 8:
+        return (
+            "🌅 *Rise and shine, Namibia lovers!*\n\nWhat's everyone up to today?\n\n📱 Check /menu for Namibia info!",
+            "☀️ *Early morning vibes!*\n\nAnyone planning a Namibia adventure?\n\n💡 Use /menu to explore!",
+            "🌄 *Good morning, everyone!*\n\nWhat aspect of Namibia interests you most?\n\n📚 Try /menu!"
+        )
+    elif 8 <= hour < 12:
+        return (
+            "☕ *Good morning, Namibia enthusiasts!*\n\nWhat brings you here today?\n\n📱 Use /menu to discover!",
+            "🌞 *Morning everyone!*\n\nReady to learn something amazing about Namibia?\n\n💡 Check /menu!",
+            "👋 *Good morning!*\n\nAsk me anything about Namibia or use /menu! 🇳🇦"
+        )
+    elif 12 <= hour < 17:
+        return (
+            "🌤️ *Good afternoon, everyone!*\n\nWhat Namibia topic shall we explore?\n\n📱 Use /menu!",
+            "☀️ *Afternoon vibes!*\n\nAnyone curious about Namibia wildlife?\n\n🦁 Try /menu → Wildlife!",
+            "👋 *Good afternoon!*\n\nI'm here to answer Namibia questions! 🇳🇦\n\n💡 /menu for topics!"
+        )
+    elif 17 <= hour < 21:
+        return (
+            "🌆 *Good evening, Namibia fans!*\n\nHow's everyone doing?\n\n📱 Use /menu to explore!",
+            "🌅 *Evening everyone!*\n\nPerfect time to learn about Namibia!\n\n💡 Check /menu!",
+            "👋 *Good evening!*\n\nReady for some Namibia facts? 🇳🇦\n\n📚 Try /menu!"
+        )
+    else:
+        return (
+            "🌙 *Good evening, night owls!*\n\nWhat Namibia topic interests you?\n\n📱 Use /menu!",
+            "✨ *Hello everyone!*\n\nI'm here if you need Namibia info! 🇳🇦\n\n💡 Try /menu!",
+            "🌟 *Evening, travelers!*\n\nAsk me about Namibia anytime!\n\n📚 Use /menu!"
+        )
+
+PERIODIC_GREETINGS_BY_HOUR = tuple(periodic_greetings_for_hour(hour) for hour in range(24))
+
 # =========================================================
 # EVA GEISES - NAMIBIA BOT ENGINE WITH REAL ESTATE
 # =========================================================
@@ -43,151 +221,79 @@ class EvaGeisesBot:
     def __init__(self):
         self.db = Database()
         self.kb = KnowledgeBase()
-        self.last_activity = {}
+        self.last_activity = {}  # chat_id -> time.monotonic() of the last message
         self.welcomed_users = set()
-        self.last_greeting = {}
-        self.last_property_post = {}
-        logger.info(f"🇳🇦 Eva Geises initialized with {len(self.kb.get_all_topics())} topics")
+        self.last_greeting = {}  # chat_id -> time.monotonic() of the last periodic greeting
+        logger.info("🇳🇦 Eva Geises initialized")
     
     def get_greeting(self):
         """Get time-appropriate greeting"""
-        hour = datetime.now().hour
-        if 5 <= hour < 12:
-            return "Good morning"
-        elif 12 <= hour < 17:
-            return "Good afternoon"
-        elif 17 <= hour < 21:
-            return "Good evening"
-        else:
-            return "Hello"
+        return GREETING_BY_HOUR[time.localtime().tm_hour]
     
     def analyze_message(self, message, user_id, chat_id):
         """Analyze if Eva should respond"""
         msg = message.lower().strip()
-        self.last_activity[str(chat_id)] = datetime.now()
-        
-        response_types = []
+        self.last_activity[chat_id] = time.monotonic()
         
+        # Only the strongest match decides, so check from the highest weight down
+        # and stop at the first hit instead of scanning for every match
         # 1. Direct mentions - 100%
-        bot_mentions = ["@eva", "eva", "@namibiabot", "namibia bot", "hey bot", "hello bot", "hey eva"]
-        if any(mention in msg for mention in bot_mentions):
-            response_types.append(("search", 100))
-        
-        # 2. Questions - 90%
-        question_words = ["what", "how", "where", "when", "why", "who", "which", 
-                         "can you", "tell me", "explain", "show me", "is", "are", "do", "does"]
-        if "?" in msg or any(msg.startswith(w) for w in question_words):
-            response_types.append(("search", 90))
-        
-        # 3. Greetings - 80%
-        greetings = ["hi", "hello", "hey", "good morning", "good afternoon", "good evening", 
-                    "moro", "greetings", "hallo", "howzit"]
-        if any(g in msg.split() for g in greetings):
-            response_types.append(("greeting", 80))
-        
+        if BOT_MENTION_RE.search(msg):
+            response_type, weight = "search", 100
+        # 2. Real estate keywords - 95%
+        elif REAL_ESTATE_RE.search(msg):
+            response_type, weight = "search", 95
+        # 3. Questions and specific topics - 90%
+        elif "?" in msg or msg.startswith(QUESTION_WORDS) or TOPIC_RE.search(msg):
+            response_type, weight = "search", 90
         # 4. Namibia mentions - 85%
-        if "namibia" in msg or "namibian" in msg:
-            response_types.append(("search", 85))
-        
-        # 5. Real estate keywords - 95%
-        real_estate_keywords = ["house", "property", "land", "plot", "sale", "buy", 
-                               "real estate", "windhoek west", "omuthiya", "okahandja",
-                               "bedroom", "bedroomed", "rent", "invest"]
-        if any(keyword in msg for keyword in real_estate_keywords):
-            response_types.append(("search", 95))
-        
-        # 6. Specific topics - 90%
-        topics = ["etosha", "sossusvlei", "swakopmund", "windhoek", "himba", "herero", 
-                 "desert", "dunes", "fish river", "cheetah", "elephant", "lion", "wildlife",
-                 "safari", "namib", "capital", "visa", "currency", "weather"]
-        if any(t in msg for t in topics):
-            response_types.append(("search", 90))
-        
-        # 7. Travel keywords - 80%
-        travel = ["travel", "tour", "visit", "trip", "vacation", "holiday", 
-                 "destination", "tourist", "booking"]
-        if any(w in msg for w in travel):
-            response_types.append(("search", 80))
-        
-        # 8. Quiet chat - 30%
-        if self.is_chat_quiet(chat_id, minutes=20):
-            response_types.append(("conversation_starter", 30))
-        
-        if response_types:
-            response_types.sort(key=lambda x: x[1], reverse=True)
-            top = response_types[0]
-            if random.random() < (top[1] / 100):
-                return True, top[0]
+        elif "namibia" in msg or "namibian" in msg:
+            response_type, weight = "search", 85
+        # 5. Greetings - 80% (ahead of travel, which ties)
+        elif not GREETING_WORDS.isdisjoint(msg.split()):
+            response_type, weight = "greeting", 80
+        # 6. Travel keywords - 80%
+        elif TRAVEL_RE.search(msg):
+            response_type, weight = "search", 80
+        # 7. Quiet chat - 30%
+        elif self.is_chat_quiet(chat_id, minutes=20):
+            response_type, weight = "conversation_starter", 30
+        else:
+            return False, None
+        
+        if random.random() < (weight / 100):
+            return True, response_type
         
         return False, None
     
     def is_chat_quiet(self, chat_id, minutes=20):
         """Check if chat quiet"""
-        chat_id_str = str(chat_id)
-        if chat_id_str not in self.last_activity:
-            return True
-        return datetime.now() - self.last_activity[chat_id_str] > timedelta(minutes=minutes)
+        last = self.last_activity.get(chat_id)
+        return last is None or time.monotonic() - last > minutes * 60
     
     def should_send_greeting(self, chat_id):
         """Check if should send periodic greeting (every 2 hours)"""
-        chat_id_str = str(chat_id)
-        now = datetime.now()
-        
-        if chat_id_str not in self.last_greeting:
-            self.last_greeting[chat_id_str] = now
-            return True
+        now = time.monotonic()
+        last = self.last_greeting.get(chat_id)
         
-        if now - self.last_greeting[chat_id_str] > timedelta(hours=2):
-            self.last_greeting[chat_id_str] = now
+        if last is None or now - last > 2 * 60 * 60:
+            self.last_greeting[chat_id] = now
             return True
         
         return False
     
     def get_periodic_greeting(self):
         """Get varied time-based greetings"""
-        hour = datetime.now().hour
-        
-        if 5 <= hour < 8:
-            greetings = [
-                "🌅 *Rise and shine, Namibia lovers!*\n\nWhat's everyone up to today?\n\n📱 Check /menu for Namibia info!",
-                "☀️ *Early morning vibes!*\n\nAnyone planning a Namibia adventure?\n\n💡 Use /menu to explore!",
-                "🌄 *Good morning, everyone!*\n\nWhat aspect of Namibia interests you most?\n\n📚 Try /menu!"
-            ]
-        elif 8 <= hour < 12:
-            greetings = [
-                "☕ *Good morning, Namibia enthusiasts!*\n\nWhat brings you here today?\n\n📱 Use /menu to discover!",
-                "🌞 *Morning everyone!*\n\nReady to learn something amazing about Namibia?\n\n💡 Check /menu!",
-                "👋 *Good morning!*\n\nAsk me anything about Namibia or use /menu! 🇳🇦"
-            ]
-        elif 12 <= hour < 17:
-            greetings = [
-                "🌤️ *Good afternoon, everyone!*\n\nWhat Namibia topic shall we explore?\n\n📱 Use /menu!",
-                "☀️ *Afternoon vibes!*\n\nAnyone curious about Namibia wildlife?\n\n🦁 Try /menu → Wildlife!",
-                "👋 *Good afternoon!*\n\nI'm here to answer Namibia questions! 🇳🇦\n\n💡 /menu for topics!"
-            ]
-        elif 17 <= hour < 21:
-            greetings = [
-                "🌆 *Good evening, Namibia fans!*\n\nHow's everyone doing?\n\n📱 Use /menu to explore!",
-                "🌅 *Evening everyone!*\n\nPerfect time to learn about Namibia!\n\n💡 Check /menu!",
-                "👋 *Good evening!*\n\nReady for some Namibia facts? 🇳🇦\n\n📚 Try /menu!"
-            ]
-        else:
-            greetings = [
-                "🌙 *Good evening, night owls!*\n\nWhat Namibia topic interests you?\n\n📱 Use /menu!",
-                "✨ *Hello everyone!*\n\nI'm here if you need Namibia info! 🇳🇦\n\n💡 Try /menu!",
-                "🌟 *Evening, travelers!*\n\nAsk me about Namibia anytime!\n\n📚 Use /menu!"
-            ]
-        
-        return random.choice(greetings)
+        return random.choice(PERIODIC_GREETINGS_BY_HOUR[time.localtime().tm_hour])
     
-    def generate_response(self, message, response_type):
+    async def generate_response(self, message, response_type):
         """Generate Eva's response"""
-        clean_msg = re.sub(r'@[^\s]*', '', message.lower()).strip()
-        clean_msg = re.sub(r'(hey|hello|hi)\s+(eva|bot|namibia)', '', clean_msg).strip()
+        clean_msg = MENTION_RE.sub('', message.lower()).strip()
+        clean_msg = BOT_GREETING_RE.sub('', clean_msg).strip()
         
         # Search knowledge base
         if response_type == "search" and clean_msg:
-            results = self.kb.search(clean_msg, limit=3)
+            results = await self.kb.search_async(clean_msg, limit=3)
             
             if results:
                 best = results[0]
@@ -219,16 +325,8 @@ class EvaGeisesBot:
                 )
         
         # Greeting responses
-        greeting = self.get_greeting()
-        
         if response_type == "greeting":
-            greetings = [
-                f"👋 {greeting}! How can I help you explore Namibia today?\n\n📱 Use /menu to browse topics!",
-                f"🇳🇦 {greeting}! What would you like to know about Namibia?\n\n💡 Try /menu for categories!",
-                f"🦁 {greeting}! I'm Eva, your Namibia guide. Ask away!\n\n📚 Check /menu for all topics!",
-                f"🏜️ {greeting}! Ready to discover Namibia?\n\n✨ Use /menu to explore!"
-            ]
-            return random.choice(greetings)
+            return random.choice(GREETING_REPLIES[self.get_greeting()])
         
         # Conversation starter
         if response_type == "conversation_starter":
@@ -238,15 +336,7 @@ class EvaGeisesBot:
     
     def get_conversation_starter(self):
         """Generate conversation starter"""
-        starters = [
-            "💭 *Question for everyone:* What's your dream Namibia destination?\n\n📱 Use /menu to explore destinations!",
-            "🦁 *Wildlife talk:* Who has been on safari in Namibia?\n\n🦓 Check /menu → Wildlife for more!",
-            "🏜️ *Fun fact:* The Namib Desert is 55-80 million years old!\n\n📚 Use /menu for more Namibia facts!",
-            "👥 *Cultural question:* What interests you about Namibia's people?\n\n💡 Try /menu → Culture!",
-            "🗺️ *Travel tip:* Best time to visit is May-October!\n\n✈️ Use /menu → Tourism for planning!",
-            "🌅 *Amazing:* Sossusvlei has the world's highest dunes!\n\n📖 Discover more with /menu!"
-        ]
-        return random.choice(starters)
+        return random.choice(CONVERSATION_STARTERS)
     
     def generate_welcome(self, name):
         """Welcome new members"""
@@ -266,9 +356,15 @@ class InteractiveMenu:
     def __init__(self, kb):
         self.kb = kb
         self.categories = kb.get_categories()
+        self._main_menu = None
+        self._submenus = {}  # (category, topic names) -> markup, valid for _submenu_generation
+        self._submenu_generation = kb.generation
     
     def main_menu(self):
-        """Create main menu"""
+        """Get the main menu, built once since its buttons never change"""
+        if self._main_menu is not None:
+            return self._main_menu
+        
         keyboard = [
             [InlineKeyboardButton("🏠 Real Estate", callback_data="cat_Real Estate")],
             [InlineKeyboardButton("🏞️ Tourism", callback_data="cat_Tourism")],
@@ -279,11 +375,29 @@ class InteractiveMenu:
             [InlineKeyboardButton("🔍 Quick Facts", callback_data="cat_Facts")],
             [InlineKeyboardButton("🗺️ Geography", callback_data="cat_Geography")],
         ]
-        return InlineKeyboardMarkup(keyboard)
-    
-    def create_submenu(self, category):
+        self._main_menu = InlineKeyboardMarkup(keyboard)
+        return self._main_menu
+    
+    def create_submenu(self, category, topics):
+        """Get a category's submenu, rebuilding it only after the knowledge changed"""
+        generation = self.kb.generation
+        if generation != self._submenu_generation:
+            self._submenus.clear()
+            self._submenu_generation = generation
+        
+        # Keyed on the topic names too, so topics read just before a sync never
+        # leave a stale keyboard cached under the new generation
+        key = (category, tuple(topic['topic'] for topic in topics))
+        markup = self._submenus.get(key)
+        if markup is None:
+            markup = self._build_submenu(category, topics)
+            # Callback data comes from clients, so only categories with topics are kept
+            if topics:
+                self._submenus[key] = markup
+        return markup
+    
+    def _build_submenu(self, category, topics):
         """Create submenu with individual topic buttons"""
-        topics = self.kb.get_by_category(category)
         keyboard = []
         
         if topics:
@@ -320,10 +434,8 @@ class InteractiveMenu:
         
         return InlineKeyboardMarkup(keyboard)
     
-    def format_category(self, category):
+    def format_category(self, category, topics):
         """Format category overview"""
-        topics = self.kb.get_by_category(category)
-        
         emoji_map = {
             "Real Estate": "🏠",
             "Tourism": "🏞️", "History": "📜", "Culture": "👥",
@@ -358,86 +470,21 @@ eva = EvaGeisesBot()
 menu = InteractiveMenu(eva.kb)
 
 # =========================================================
-# PROPERTY POSTING SCHEDULER
+# QUERY LOG FLUSHER
 # =========================================================
-async def post_daily_property(context: ContextTypes.DEFAULT_TYPE):
-    """Post one property per day to registered chats"""
+async def flush_query_logs(context: ContextTypes.DEFAULT_TYPE):
+    """Write buffered query logs to the database"""
     try:
-        properties = eva.kb.get_by_category("Real Estate")
-        
-        if not properties:
-            return
-        
-        # Get all group chats where bot is active
-        chats = eva.db.get_active_chats()
-        
-        for chat in chats:
-            chat_id = chat['chat_id']
-            chat_key = str(chat_id)
-            
-            # Get last posted property index
-            last_index = eva.last_property_post.get(chat_key, -1)
-            
-            # Get next property (cycle through properties)
-            next_index = (last_index + 1) % len(properties)
-            property_data = properties[next_index]
-            
-            # Format property message
-            message = f"🏠 *Featured Property of the Day*\n\n"
-            message += f"**{property_data['topic']}**\n\n"
-            message += f"{property_data['content']}\n\n"
-            message += f"📱 Use /menu → Real Estate for all properties!"
-            
-            try:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=message,
-                    parse_mode="Markdown"
-                )
-                
-                # Update last posted index
-                eva.last_property_post[chat_key] = next_index
-                
-                logger.info(f"Posted property to chat {chat_id}")
-                
-                # Wait between posts to avoid rate limits
-                await asyncio.sleep(1)
-                
-            except Exception as e:
-                logger.error(f"Error posting to chat {chat_id}: {e}")
-    
+        eva.db.flush_query_logs()
     except Exception as e:
-        logger.error(f"Error in property posting: {e}")
+        logger.error(f"❌ Error flushing query logs: {e}")
 
 # =========================================================
-# GREETING SCHEDULER
+# STARTUP
 # =========================================================
-async def send_periodic_greetings(context: ContextTypes.DEFAULT_TYPE):
-    """Send periodic greetings to active chats"""
-    try:
-        chats = eva.db.get_active_chats()
-        
-        for chat in chats:
-            chat_id = chat['chat_id']
-            
-            if eva.should_send_greeting(chat_id):
-                greeting = eva.get_periodic_greeting()
-                
-                try:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=greeting,
-                        parse_mode="Markdown"
-                    )
-                    
-                    logger.info(f"Sent greeting to chat {chat_id}")
-                    await asyncio.sleep(1)
-                    
-                except Exception as e:
-                    logger.error(f"Error sending greeting to {chat_id}: {e}")
-    
-    except Exception as e:
-        logger.error(f"Error in greeting scheduler: {e}")
+async def post_init(application: Application):
+    """Start background work once the application is up"""
+    eva.kb.start_background_sync()
 
 # =========================================================
 # COMMAND HANDLERS
@@ -455,39 +502,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     greeting = eva.get_greeting()
     
     if update.message.chat.type in ['group', 'supergroup']:
-        welcome = f"""🇳🇦 *Eva Geises - Namibia Expert Bot*
-
-{greeting} everyone! I'm Eva Geises, your AI-powered Namibia assistant! 🦁
-
-*I can help with:*
-• Real Estate Properties 🏠
-• Tourism & Travel Planning 🏞️
-• Wildlife & Safari Info 🦓
-• Cultural Insights & History 👥
-• Practical Travel Advice ℹ️
-• Geography & Quick Facts 🗺️
-
-*How to use me:*
-• Ask questions naturally - I understand!
-• Mention "Namibia" - I'll join in!
-• Use /menu for organized topics
-• I respond to greetings warmly!
-• I welcome new members automatically!
-
-*Try asking:*
-• "Where is Namibia?"
-• "Tell me about Etosha"
-• "What properties are for sale?"
-• "Best time to visit?"
-
-*Quick Commands:*
-/menu - Browse categories 📚
-/properties - View real estate 🏠
-/topics - List all topics 📋
-/stats - Your statistics 📊
-/help - Help info 🆘
-
-🇳🇦 Let's explore Namibia together! 🏜️"""
+        welcome = GROUP_WELCOME_TEXT[greeting]
         
         await update.message.reply_text(welcome, parse_mode="Markdown")
     else:
@@ -502,14 +517,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /menu"""
     await update.message.reply_text(
-        "🇳🇦 *I am here to help learn Namibia*\n\nWhat would you like to explore?",
+        MENU_TEXT,
         parse_mode="Markdown",
         reply_markup=menu.main_menu()
     )
 
 async def properties_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /properties - show all real estate listings"""
-    properties = eva.kb.get_by_category("Real Estate")
+    properties = await eva.kb.get_by_category_async("Real Estate")
     
     if properties:
         response = "🏠 *Available Properties in Namibia*\n\n"
@@ -526,7 +541,7 @@ async def properties_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def topics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /topics"""
-    topics = eva.kb.get_all_topics()
+    topics = await eva.kb.get_all_topics_async()
     
     if topics:
         response = "📚 *All Namibia Topics:*\n\n"
@@ -544,17 +559,19 @@ async def topics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /stats"""
     user_id = update.effective_user.id
+    topic_count = len(await eva.kb.get_all_topics_async())
+    category_count = len(await eva.kb.get_categories_async())
     
     if user_id in ADMIN_IDS:
-        all_users = eva.db.get_all_users()
+        user_count = eva.db.get_user_count()
         popular = eva.db.get_popular_queries(5)
         
         stats = f"""📊 *Eva Geises Statistics (Admin)*
 
 *System:*
-• Total users: {len(all_users)}
-• Topics: {len(eva.kb.get_all_topics())}
-• Categories: {len(eva.kb.get_categories())}
+• Total users: {user_count}
+• Topics: {topic_count}
+• Categories: {category_count}
 
 *Popular Questions:*
 """
@@ -565,16 +582,18 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(stats, parse_mode="Markdown")
     else:
         user_stats = eva.db.get_user_stats(user_id)
+        joined = user_stats['joined_date']
+        since = datetime.fromtimestamp(joined, timezone.utc).strftime('%Y-%m-%d') if joined else 'Recently'
         
         stats = f"""📊 *Your Statistics*
 
 *Activity:*
 • Questions: {user_stats['query_count']}
-• Since: {user_stats['joined_date'][:10] if user_stats['joined_date'] else 'Recently'}
+• Since: {since}
 
 *Available:*
-• Topics: {len(eva.kb.get_all_topics())}
-• Categories: {len(eva.kb.get_categories())}
+• Topics: {topic_count}
+• Categories: {category_count}
 
 📱 Use /menu to explore! 🇳🇦"""
         
@@ -584,39 +603,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help"""
     greeting = eva.get_greeting()
     
-    help_text = f"""🆘 *Eva Geises - Help*
-
-{greeting}! I'm Eva, your AI Namibia expert! 🇳🇦
-
-*What I know:*
-• Real estate properties 🏠
-• Tourism & destinations 🏞️
-• Wildlife & safaris 🦁
-• Culture & people 👥
-• History & heritage 📜
-• Practical travel info ℹ️
-• Geography & facts 🗺️
-
-*How to use me:*
-• Ask natural questions
-• Use /menu for categories
-• I respond to greetings!
-• I join Namibia discussions!
-
-*Examples:*
-"Where is Namibia?"
-"Tell me about Etosha"
-"What properties for sale?"
-"Best time to visit?"
-
-*Commands:*
-/menu - Categories 📚
-/properties - Real estate 🏠
-/topics - All topics 📋
-/stats - Statistics 📊
-/help - This message 🆘
-
-🇳🇦 Ask me anything! 🦁"""
+    help_text = HELP_TEXT[greeting]
     
     await update.message.reply_text(help_text, parse_mode="Markdown")
 
@@ -644,7 +631,7 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         category = parts[2].strip() if len(parts) > 2 else 'General'
         keywords = parts[3].strip() if len(parts) > 3 else ''
         
-        eva.kb.add_knowledge(topic, content, category, keywords)
+        await eva.kb.add_knowledge_async(topic, content, category, keywords)
         await update.message.reply_text(f"✅ Added: *{topic}*", parse_mode="Markdown")
     except Exception as e:
         await update.message.reply_text(f"❌ Error: {e}")
@@ -658,14 +645,13 @@ async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYP
     chat_id = update.effective_chat.id
     message = update.message.text
     
-    eva.db.add_user(user_id, update.effective_user.username or "Unknown")
-    eva.db.log_query(user_id, message)
+    eva.db.log_user_query(user_id, update.effective_user.username or "Unknown", message)
     
     should_respond, response_type = eva.analyze_message(message, user_id, chat_id)
     
     if should_respond and response_type:
         logger.info(f"Eva responding: {message[:50]}... ({response_type})")
-        response = eva.generate_response(message, response_type)
+        response = await eva.generate_response(message, response_type)
         
         if response:
             await asyncio.sleep(random.uniform(0.5, 1.5))
@@ -688,7 +674,7 @@ async def handle_private_message(update: Update, context: ContextTypes.DEFAULT_T
     user_id = update.effective_user.id
     message = update.message.text
     
-    results = eva.kb.search(message, limit=3)
+    results = await eva.kb.search_async(message, limit=3)
     
     if results:
         response = "🔍 *Search Results:*\n\n"
@@ -738,7 +724,7 @@ async def post_daily_property(context: ContextTypes.DEFAULT_TYPE):
             return
         
         # Get all real estate properties
-        properties = eva.kb.get_by_category("Real Estate")
+        properties = await eva.kb.get_by_category_async("Real Estate")
         
         if not properties:
             logger.warning("⚠️ No real estate properties found")
@@ -825,7 +811,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Main menu
     if data == "menu_back":
         await query.edit_message_text(
-            "🇳🇦 *I am here to help learn Namibia*\n\nWhat would you like to explore?",
+            MENU_TEXT,
             parse_mode="Markdown",
             reply_markup=menu.main_menu()
         )
@@ -833,12 +819,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Category selection - show submenu with topic buttons
     elif data.startswith("cat_"):
         category = data.replace("cat_", "")
-        content = menu.format_category(category)
+        # Topics come from the executor so the callback never queries SQLite on the loop
+        topics = await eva.kb.get_by_category_async(category)
+        content = menu.format_category(category, topics)
         
         await query.edit_message_text(
             content,
             parse_mode="Markdown",
-            reply_markup=menu.create_submenu(category)
+            reply_markup=menu.create_submenu(category, topics)
         )
     
     # Topic selection - show detailed information
@@ -852,7 +840,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except:
                 topic_index = 0
             
-            topics = eva.kb.get_by_category(category)
+            topics = await eva.kb.get_by_category_async(category)
             
             if topics and 0 <= topic_index < len(topics):
                 topic = topics[topic_index]
@@ -871,7 +859,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 response += f"{topic['content']}\n\n"
                 
                 # Add keywords if available
-                if topic.get('keywords'):
+                if topic['keywords']:
                     keywords = topic['keywords'].strip()
                     if keywords:
                         response += f"🏷️ *Keywords:* {keywords}\n\n"
@@ -910,6 +898,7 @@ def main():
         .connect_timeout(15) \
         .read_timeout(10) \
         .write_timeout(10) \
+        .post_init(post_init) \
         .build()
     
     # Add handlers
@@ -941,6 +930,14 @@ def main():
         name="periodic_greetings"
     )
     
+    # Flush buffered query logs (every 2 seconds)
+    job_queue.run_repeating(
+        flush_query_logs,
+        interval=2,
+        first=2,
+        name="flush_query_logs"
+    )
+    
     logger.info("🚀 Eva is running with automated features...")
     logger.info("📅 Daily property posts at 10:00 AM")
     logger.info("👋 Periodic greetings every 2 hours")